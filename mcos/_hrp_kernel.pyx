@@ -0,0 +1,30 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled kernel for the HRPOptimizer, used in place of the numba kernels when numba isn't installed
+"""
+
+
+cpdef double cluster_var(const double[:, :] cov, const Py_ssize_t[:] indices) noexcept nogil:
+    """
+    Calculates the overall variance of a cluster assuming the inverse variance portfolio weights of its constituents
+    :param cov: covariance matrix
+    :param indices: indices of the constituents of the cluster in cov
+    :return: variance of the cluster
+    """
+    cdef Py_ssize_t n = indices.shape[0]
+    cdef Py_ssize_t i, j
+    cdef double ivp_sum = 0.
+    cdef double var = 0.
+    cdef double row
+
+    for i in range(n):
+        ivp_sum += 1. / cov[indices[i], indices[i]]
+
+    # w_i = (1 / cov_ii) / ivp_sum, var = sum_ij w_i cov_ij w_j
+    for i in range(n):
+        row = 0.
+        for j in range(n):
+            row += cov[indices[i], indices[j]] / cov[indices[j], indices[j]]
+        var += row / cov[indices[i], indices[i]]
+
+    return var / (ivp_sum * ivp_sum)
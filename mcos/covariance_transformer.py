@@ -1,7 +1,10 @@
+import hashlib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 import numpy as np
 from numpy import linalg
 from sklearn.neighbors import KernelDensity
+from scipy import linalg as sp_linalg
 from scipy.optimize import minimize
 import pandas as pd
 
@@ -53,11 +56,15 @@ class AbstractCovarianceTransformer(ABC):
 
 
 class DeNoiserCovarianceTransformer(AbstractCovarianceTransformer):
-    def __init__(self, bandwidth: float = .25):
+    def __init__(self, bandwidth: float = .25, cache_size: int = 64):
         """
         :param bandwidth: bandwidth hyper-parameter for KernelDensity
+        :param cache_size: number of de-noised covariance matrices to keep, so that transforming the same matrix again
+        skips the eigen-decomposition and the Marcenko-Pastur fit
         """
         self.bandwidth = bandwidth
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
 
     def transform(self, cov: np.array, n_observations: int) -> np.array:
         """
@@ -72,6 +79,28 @@ class DeNoiserCovarianceTransformer(AbstractCovarianceTransformer):
         For more info see section 4.2 of "A Robust Estimator of the Efficient Frontier",
         this function and the functions it calls are all modified from this section
 
+        :param cov: the covariance matrix we want to de-noise
+        :param n_observations: the number of observations used to create the covariance matrix
+        :return: de-noised covariance matrix
+        """
+        cov = np.ascontiguousarray(cov)
+        key = (
+            cov.shape, cov.dtype.str, n_observations, self.bandwidth,
+            hashlib.blake2b(cov.tobytes(), digest_size=16).digest()
+        )
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            self._cache[key] = self._de_noise(cov, n_observations)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)  # evict the least recently used matrix
+
+        return self._cache[key].copy()
+
+    def _de_noise(self, cov: np.array, n_observations: int) -> np.array:
+        """
+        De-noises the covariance matrix, see transform
         :param cov: the covariance matrix we want to de-noise
         :param n_observations: the number of observations used to create the covariance matrix
         :return: de-noised covariance matrix
@@ -82,31 +111,34 @@ class DeNoiserCovarianceTransformer(AbstractCovarianceTransformer):
         # get correlation matrix based on covariance matrix
         correlation_matrix = cov_to_corr(cov)
 
-        # Get eigenvalues and eigenvectors in the correlation matrix
-        eigenvalues, eigenvectors = self._get_PCA(correlation_matrix)
+        # Get eigenvalues in the correlation matrix, all of them are needed to fit the Marcenko-Pastur distribution
+        eigenvalues = np.linalg.eigvalsh(correlation_matrix)[::-1]
 
         # Find max random eigenvalue
-        max_eigenvalue = self._find_max_eigenvalue(np.diag(eigenvalues), q)
+        max_eigenvalue = self._find_max_eigenvalue(eigenvalues, q)
 
-        # de-noise the correlation matrix
-        n_facts = eigenvalues.shape[0] - np.diag(eigenvalues)[::-1].searchsorted(max_eigenvalue)
+        # de-noise the correlation matrix, only the eigenvectors of the signal eigenvalues are needed for that
+        n_facts = eigenvalues.shape[0] - eigenvalues[::-1].searchsorted(max_eigenvalue)
+        eigenvectors = self._get_signal_eigenvectors(correlation_matrix, n_facts)
         correlation_matrix = self._de_noised_corr(eigenvalues, eigenvectors, n_facts)
 
         # recover covariance matrix from correlation matrix
         de_noised_covariance_matrix = corr_to_cov(correlation_matrix, np.diag(cov) ** .5)
         return de_noised_covariance_matrix
 
-    def _get_PCA(self, matrix: np.array) -> (np.array, np.array):
+    def _get_signal_eigenvectors(self, matrix: np.array, n_facts: int) -> np.array:
         """
-        Gets eigenvalues and eigenvectors from a Hermitian matrix
+        Gets the eigenvectors of the n_facts largest eigenvalues of a Hermitian matrix, without computing the others
         :param matrix: a Hermitian matrix
-        :return: array of eigenvalues and array of eigenvectors
+        :param n_facts: number of eigenvectors to compute
+        :return: array of eigenvectors as columns, sorted by eigenvalue desc
         """
-        eigenvalues, eigenvectors = np.linalg.eigh(matrix)
-        indices = eigenvalues.argsort()[::-1]  # arguments for sorting eigenvalues desc
-        eigenvalues, eigenvectors = eigenvalues[indices], eigenvectors[:, indices]
-        eigenvalues = np.diagflat(eigenvalues)
-        return eigenvalues, eigenvectors
+        n = matrix.shape[0]
+        if n_facts == 0:
+            return np.empty((n, 0))
+
+        _, eigenvectors = sp_linalg.eigh(matrix, subset_by_index=[n - n_facts, n - 1], driver='evr')
+        return eigenvectors[:, ::-1]
 
     def _find_max_eigenvalue(self, eigenvalues: np.array, q: float) -> float:
         """
@@ -194,16 +226,19 @@ class DeNoiserCovarianceTransformer(AbstractCovarianceTransformer):
     def _de_noised_corr(self, eigenvalues: np.array, eigenvectors: np.array, n_facts: int) -> np.array:
         """
         Shrinks the eigenvalues associated with noise, and returns a de-noised correlation matrix
-        :param eigenvalues: array of eigenvalues
-        :param eigenvectors: array of eigenvectors
-        :param n_facts: number of elements in diagonalized eigenvalues to replace with the mean of eigenvalues
+        :param eigenvalues: array of all eigenvalues, sorted desc
+        :param eigenvectors: array of the eigenvectors of the n_facts largest eigenvalues
+        :param n_facts: number of signal eigenvalues, the rest are replaced with their mean
         :return: de-noised correlation matrix
         """
-        # Remove noise from corr by fixing random eigenvalues
-        eigenvalues_ = np.diag(eigenvalues).copy()
-        eigenvalues_[n_facts:] = eigenvalues_[n_facts:].sum() / float(eigenvalues_.shape[0] - n_facts)
-        eigenvalues_ = np.diag(eigenvalues_)
-        corr = np.dot(eigenvectors, eigenvalues_).dot(eigenvectors.T)
+        corr = np.dot(eigenvectors * eigenvalues[:n_facts], eigenvectors.T)
+
+        # Remove noise from corr by fixing random eigenvalues. The noise eigenvectors span the orthogonal complement of
+        # the signal eigenvectors, so with a single shared eigenvalue their part is that value times its projection.
+        if n_facts < eigenvalues.shape[0]:
+            projection = np.eye(eigenvalues.shape[0]) - np.dot(eigenvectors, eigenvectors.T)
+            corr += eigenvalues[n_facts:].mean() * projection
+
         corr = cov_to_corr(corr)
         return corr
 
@@ -1,5 +1,6 @@
 import numpy as np
 from abc import ABC, abstractmethod
+from typing import Dict
 
 
 class AbstractErrorEstimator(ABC):
@@ -17,6 +18,23 @@ class AbstractErrorEstimator(ABC):
         """
         pass
 
+    def estimate_batch(self, mu: np.array, cov: np.array, allocations: np.array,
+                       optimal_allocation: np.array) -> np.array:
+        """
+        Measures how far each of a stack of allocations is from the desired allocation. Estimators that can evaluate
+        the whole stack at once should override this, by default estimate is called for every allocation.
+        @param mu: Expected return vector
+        @param cov: Expected covariance matrix
+        @param allocations: Portfolio allocations with shape (..., n_assets)
+        @param optimal_allocation: Optimal portfolio allocations, broadcastable against allocations
+        @return Array of estimates with shape allocations.shape[:-1]
+        """
+        optimal_allocation = np.broadcast_to(optimal_allocation, allocations.shape)
+        estimates = np.empty(allocations.shape[:-1])
+        for idx in np.ndindex(*estimates.shape):
+            estimates[idx] = self.estimate(mu, cov, allocations[idx], optimal_allocation[idx])
+        return estimates
+
 
 class ExpectedOutcomeErrorEstimator(AbstractErrorEstimator):
     """Error Estimator that calculates the mean difference in expected outcomes"""
@@ -24,6 +42,10 @@ class ExpectedOutcomeErrorEstimator(AbstractErrorEstimator):
     def estimate(self, mu: np.array, cov: np.array, allocation: np.array, optimal_allocation: np.array) -> float:
         return _mean_difference_expected_outcome(optimal_allocation, allocation, mu)
 
+    def estimate_batch(self, mu: np.array, cov: np.array, allocations: np.array,
+                       optimal_allocation: np.array) -> np.array:
+        return batch_errors(mu, cov, allocations, optimal_allocation)['outcome']
+
 
 class VarianceErrorEstimator(AbstractErrorEstimator):
     """Error Estimator that calculates the mean difference in variance"""
@@ -31,6 +53,10 @@ class VarianceErrorEstimator(AbstractErrorEstimator):
     def estimate(self, mu: np.array, cov: np.array, allocation: np.array, optimal_allocation: np.array) -> float:
         return _mean_difference_variance(cov, allocation, optimal_allocation)
 
+    def estimate_batch(self, mu: np.array, cov: np.array, allocations: np.array,
+                       optimal_allocation: np.array) -> np.array:
+        return batch_errors(mu, cov, allocations, optimal_allocation)['variance']
+
 
 class SharpeRatioErrorEstimator(AbstractErrorEstimator):
     """Error estimator that calculates the mean difference in Sharpe ratio"""
@@ -40,6 +66,28 @@ class SharpeRatioErrorEstimator(AbstractErrorEstimator):
         mean_difference_variance = _mean_difference_variance(cov, allocation, optimal_allocation)
         return mean_difference_expected_outcome / np.sqrt(mean_difference_variance)
 
+    def estimate_batch(self, mu: np.array, cov: np.array, allocations: np.array,
+                       optimal_allocation: np.array) -> np.array:
+        return batch_errors(mu, cov, allocations, optimal_allocation)['sharpe']
+
+
+def batch_errors(mu: np.array, cov: np.array, allocations: np.array,
+                 optimal_allocation: np.array) -> Dict[str, np.array]:
+    """
+    Computes the differences in expected outcome, variance and Sharpe ratio for a whole stack of allocations at once.
+    The allocation differences are loaded once for a single matrix product and a single quadratic form, and the Sharpe
+    ratio is derived from those two.
+    @param mu: Expected return vector
+    @param cov: Expected covariance matrix
+    @param allocations: Portfolio allocations with shape (..., n_assets)
+    @param optimal_allocation: Optimal portfolio allocations, broadcastable against allocations
+    @return Dictionary of 'outcome', 'variance' and 'sharpe' arrays with shape allocations.shape[:-1]
+    """
+    difference = optimal_allocation - allocations
+    outcome = difference @ np.ravel(mu)
+    variance = np.einsum('...i,ij,...j->...', difference, cov, difference, optimize=True)
+    return {'outcome': outcome, 'variance': variance, 'sharpe': outcome / np.sqrt(variance)}
+
 
 def _mean_difference_expected_outcome(optimal_allocation: np.array, allocation: np.array, mu: np.array) -> float:
     return np.dot(optimal_allocation - allocation, mu)
@@ -1,6 +1,9 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
 import numpy as np
 import pandas as pd
-from typing import List
 
 from mcos.covariance_transformer import AbstractCovarianceTransformer
 from mcos.error_estimator import AbstractErrorEstimator
@@ -15,30 +18,80 @@ def simulate_optimizations(
         n_sims: int,
         optimizers: List[AbstractOptimizer],
         error_estimator: AbstractErrorEstimator,
-        covariance_transformers: List[AbstractCovarianceTransformer]
+        covariance_transformers: List[AbstractCovarianceTransformer],
+        n_jobs: int = 1,
+        seed: int = None
 ) -> pd.DataFrame:
-    error_estimates = {optimizer.name: [] for optimizer in optimizers}
+    """
+    Runs the MCOS procedure for every optimizer and summarises the allocation error of each one
+    :param obs_simulator: simulator used to draw the empirical means and covariances
+    :param n_sims: number of Monte Carlo simulations
+    :param optimizers: optimizers to compare
+    :param error_estimator: measure of the distance between a simulated and the optimal allocation
+    :param covariance_transformers: transformations applied to every simulated covariance matrix
+    :param n_jobs: number of worker processes used for the allocations. As in joblib, negative values count back from
+    the number of cores, -1 uses all of them, -2 all but one and so on
+    :param seed: seed for the independent random streams of the simulations, the global numpy random state is used if
+    None
+    :return: DataFrame with the mean and standard deviation of the error estimates, indexed by optimizer name
+    """
+    if n_jobs == 0:
+        raise ValueError('n_jobs must be a positive number of workers or a negative one to count back from the number '
+                         'of cores, got 0')
+    n_workers = n_jobs if n_jobs > 0 else max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+
+    # every simulation gets its own generator spawned from the seed, so no random state is shared between them
+    if seed is None:
+        rngs = [None] * n_sims
+    else:
+        rngs = [np.random.default_rng(child_seed) for child_seed in np.random.SeedSequence(seed).spawn(n_sims)]
 
-    for i in range(n_sims):
-        mu_hat, cov_hat = obs_simulator.simulate()
+    # the observations are drawn up front in this process so that the global random state is consumed in the same
+    # order regardless of how many workers the allocations are spread across
+    mu_hats, cov_hats = [], []
+    for rng in rngs:
+        # simulators written against the original simulate(self) signature only get an rng when a seed is given
+        mu_hat, cov_hat = obs_simulator.simulate() if rng is None else obs_simulator.simulate(rng)
 
         for transformer in covariance_transformers:
             cov_hat = transformer.transform(cov_hat, obs_simulator.n_observations)
 
-        for optimizer in optimizers:
-            allocation = optimizer.allocate(mu_hat, cov_hat)
-            optimal_allocation = optimizer.allocate(obs_simulator.mu, obs_simulator.cov)
+        mu_hats.append(mu_hat)
+        cov_hats.append(cov_hat)
+
+    mu_hats, cov_hats = np.stack(mu_hats), np.stack(cov_hats)
+
+    # every simulation is independent, so each optimizer gets its stack split into one chunk per worker. The optimal
+    # allocations only depend on the optimizer and are computed once each.
+    chunks = [chunk for chunk in np.array_split(np.arange(n_sims), n_workers) if len(chunk)]
+    slots = [(j, chunk) for j in range(len(optimizers)) for chunk in chunks]
+    tasks = [(optimizer, obs_simulator.mu[np.newaxis], obs_simulator.cov[np.newaxis]) for optimizer in optimizers]
+    tasks += [(optimizers[j], mu_hats[chunk], cov_hats[chunk]) for j, chunk in slots]
+
+    if n_workers == 1:
+        results = [_allocate_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_allocate_batch, tasks))
+
+    optimal_allocations = np.concatenate(results[:len(optimizers)])
+    allocations = np.empty((n_sims, len(optimizers), optimal_allocations.shape[1]))
+    for (j, chunk), result in zip(slots, results[len(optimizers):]):
+        allocations[chunk, j] = result
+
+    error_estimates = error_estimator.estimate_batch(obs_simulator.mu, obs_simulator.cov, allocations,
+                                                     optimal_allocations)
+
+    return pd.DataFrame(
+        {'mean': error_estimates.mean(axis=0), 'stdev': error_estimates.std(axis=0)},
+        index=pd.Index([optimizer.name for optimizer in optimizers], name='optimizer')
+    )
 
-            estimation = error_estimator.estimate(obs_simulator.mu, obs_simulator.cov, allocation, optimal_allocation)
-            error_estimates[optimizer.name].append(estimation)
 
-    return pd.DataFrame([
-        {
-            'optimizer': optimizer.name,
-            'mean': np.mean(error_estimates[optimizer.name]),
-            'stdev': np.std(error_estimates[optimizer.name])
-        } for optimizer in optimizers
-    ]).set_index('optimizer')
+def _allocate_batch(task: Tuple[AbstractOptimizer, np.array, np.array]) -> np.array:
+    # module level so that it can be pickled and sent to the worker processes
+    optimizer, mus, covs = task
+    return optimizer.allocate_batch(mus, covs)
 
 
 def simulate_optimizations_from_price_history(
@@ -48,7 +101,9 @@ def simulate_optimizations_from_price_history(
         n_sims: int,
         optimizers: List[AbstractOptimizer],
         error_estimator: AbstractErrorEstimator,
-        covariance_transformers: List[AbstractCovarianceTransformer]):
+        covariance_transformers: List[AbstractCovarianceTransformer],
+        n_jobs: int = 1,
+        seed: int = None):
 
     mu, cov = convert_price_history(price_history)
 
@@ -61,4 +116,4 @@ def simulate_optimizations_from_price_history(
     else:
         raise ValueError("Invalid observation simulator name")
 
-    return simulate_optimizations(sim, n_sims, optimizers, error_estimator, covariance_transformers)
+    return simulate_optimizations(sim, n_sims, optimizers, error_estimator, covariance_transformers, n_jobs, seed)
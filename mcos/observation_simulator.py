@@ -1,16 +1,15 @@
 import numpy as np
 from abc import abstractmethod, ABC
-from sklearn.covariance import LedoitWolf
 
 
 class AbstractObservationSimulator(ABC):
 
     @abstractmethod
-    def simulate(self) -> (np.array, np.array):
+    def simulate(self, rng: np.random.Generator = None) -> (np.array, np.array):
         """
         Draws empirical means and covariances. See section 4.1 of the "A Robust Estimator of the Efficient Frontier"
         paper.
-        :param n_observations: number of observations
+        :param rng: random number generator to draw the observations with, the global numpy random state if None
         @return: Tuple of expected return vector and covariance matrix
         """
         pass
@@ -22,10 +21,11 @@ class MuCovLedoitWolfObservationSimulator(AbstractObservationSimulator):
         self.mu = mu
         self.cov = cov
         self.n_observations = n_observations
+        self._mean, self._factor = mu.flatten(), _sampling_factor(cov)
 
-    def simulate(self) -> (np.array, np.array):
-        x = np.random.multivariate_normal(self.mu.flatten(), self.cov, size=self.n_observations)
-        return x.mean(axis=0).reshape(-1, 1), LedoitWolf().fit(x).covariance_
+    def simulate(self, rng: np.random.Generator = None) -> (np.array, np.array):
+        x = _draw_observations(self._mean, self._factor, self.n_observations, rng)
+        return x.mean(axis=0).reshape(-1, 1), ledoit_wolf_covariance(x)
 
 
 class MuCovObservationSimulator(AbstractObservationSimulator):
@@ -34,10 +34,12 @@ class MuCovObservationSimulator(AbstractObservationSimulator):
         self.mu = mu
         self.cov = cov
         self.n_observations = n_observations
+        self._mean, self._factor = mu.flatten(), _sampling_factor(cov)
 
-    def simulate(self) -> (np.array, np.array):
-        x = np.random.multivariate_normal(self.mu.flatten(), self.cov, size=self.n_observations)
-        return x.mean(axis=0).reshape(-1, 1), np.cov(x, rowvar=False)
+    def simulate(self, rng: np.random.Generator = None) -> (np.array, np.array):
+        x = _draw_observations(self._mean, self._factor, self.n_observations, rng)
+        x_c = x - x.mean(axis=0)
+        return x.mean(axis=0).reshape(-1, 1), x_c.T @ x_c / (len(x) - 1)
 
 
 class MuCovJackknifeObservationSimulator(AbstractObservationSimulator):
@@ -46,12 +48,70 @@ class MuCovJackknifeObservationSimulator(AbstractObservationSimulator):
         self.mu = mu
         self.cov = cov
         self.n_observations = n_observations
+        self._mean, self._factor = mu.flatten(), _sampling_factor(cov)
 
-    def simulate(self) -> (np.array, np.array):
-        x = np.random.multivariate_normal(self.mu.flatten(), self.cov, size=self.n_observations)
+    def simulate(self, rng: np.random.Generator = None) -> (np.array, np.array):
+        x = _draw_observations(self._mean, self._factor, self.n_observations, rng)
 
-        idx = np.arange(len(x))
-        cov_hat = np.sum(np.cov(x[idx!=i], rowvar=False) for i in range(len(x)))/float(len(x))
-        x_prime = np.sum(x[idx!=i] for i in range(len(x)))/float(len(x))
+        n = len(x)
+        mu = x.mean(axis=0)
+        x_c = x - mu
+        cov = x_c.T @ x_c / (n - 1)
 
-        return x_prime.mean(axis=0).reshape(-1, 1), cov_hat
+        # leaving observation k out of the mean gives (n * mu - x_k) / (n - 1), and since the x_k sum to n * mu these
+        # average to (n * n * mu - n * mu) / (n * (n - 1)) = mu
+        mu_hat = mu
+
+        # leaving observation k out is a rank-1 downdate of the full sample covariance:
+        # (n - 2) * S_{-k} = (n - 1) * S - n / (n - 1) * x_k x_k^T, where x_k is centered on the full sample mean. The
+        # centered outer products sum to (n - 1) * S, so the average of the S_{-k} is ((n - 1) * S - S) / (n - 2) = S
+        cov_hat = cov
+
+        return mu_hat.reshape(-1, 1), cov_hat
+
+
+def _sampling_factor(cov: np.array) -> np.array:
+    # factor A with A^T A = cov, computed the same way np.random.multivariate_normal does on every call
+    _, s, v = np.linalg.svd(cov)
+    return np.sqrt(s)[:, np.newaxis] * v
+
+
+def _draw_observations(mean: np.array, factor: np.array, n_observations: int,
+                       rng: np.random.Generator = None) -> np.array:
+    # equivalent to rng.multivariate_normal(mean, cov, size=n_observations), without the svd of cov
+    rng = np.random if rng is None else rng
+    x = rng.standard_normal((n_observations, len(mean))) @ factor
+    x += mean
+    return x
+
+
+def ledoit_wolf_covariance(x: np.array) -> np.array:
+    """
+    Ledoit-Wolf shrunk covariance matrix of a set of observations, see "A well-conditioned estimator for
+    large-dimensional covariance matrices". Any leading axes of x are treated as a batch, so a stack of observation sets
+    is shrunk in a single pass.
+    :param x: observations with shape (..., n_observations, n_assets)
+    :return: shrunk covariance matrix with shape (..., n_assets, n_assets)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n, p = x.shape[-2:]
+
+    x = x - x.mean(axis=-2, keepdims=True)
+    s = np.swapaxes(x, -1, -2) @ x / n  # biased sample covariance
+    identity = np.eye(p)
+
+    # shrinkage target m_n * I, and the squared distance d_n^2 of the sample covariance to it
+    m = (np.trace(s, axis1=-2, axis2=-1) / p)[..., None, None]
+    d2 = ((s - m * identity) ** 2).sum(axis=(-2, -1))
+
+    # b_n^2, how far each observation's outer product x_k x_k^T is from the sample covariance. Since the outer products
+    # sum to n * S, sum_k ||x_k x_k^T - S||^2 = sum_k ||x_k||^4 - n ||S||^2, which is the quantity sklearn accumulates
+    # block by block. It only needs the row norms, so the (n, p, p) stack of outer products is never formed.
+    row_norms = (x ** 2).sum(axis=-1)
+    b2 = ((row_norms ** 2).sum(axis=-1) - n * (s ** 2).sum(axis=(-2, -1))) / n ** 2
+    b2 = np.minimum(b2, d2)
+
+    shrinkage = np.where(d2 > 0, b2 / np.where(d2 > 0, d2, 1.), 0.)[..., None, None]
+    shrunk = (1. - shrinkage) * s + shrinkage * m * identity
+
+    return shrunk
@@ -1,23 +1,48 @@
 from __future__ import division
 
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import ClassVar, Dict, List
 
 import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy as sch
-from numpy.linalg import inv, pinv
 from pypfopt.efficient_frontier import EfficientFrontier
+from scipy.linalg import cho_factor, cho_solve
 from scipy.optimize import minimize
+from scipy.spatial.distance import squareform
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_samples
 
 from mcos.covariance_transformer import cov_to_corr
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, without it the HRP kernels below run as plain python/numpy
+    njit = None
+
+try:
+    from mcos._hrp_kernel import cluster_var
+except ImportError:  # the cython extension is optional too, it is only built when cython is available at install time
+    cluster_var = None
+
+
+def _jit(func):
+    # compiles the HRP kernels with numba when it is installed
+    return func if njit is None else njit(cache=True)(func)
+
 
 class AbstractOptimizer(ABC):
     """Helper class that provides a standard way to create a new Optimizer using inheritance"""
 
+    # Name of this optimizer. The name will be displayed in the MCOS results DataFrame.
+    name: ClassVar[str]
+
+    def __new__(cls, *args, **kwargs):
+        # name is a required class attribute, fail at construction as abstract members do rather than in the results
+        if not hasattr(cls, 'name'):
+            raise TypeError("Can't instantiate optimizer {} without a name class attribute".format(cls.__name__))
+        return super().__new__(cls)
+
     @abstractmethod
     def allocate(self, mu: np.array, cov: np.array) -> np.array:
         """
@@ -29,18 +54,23 @@ class AbstractOptimizer(ABC):
         """
         pass
 
-    @property
-    @abstractmethod
-    def name(self) -> str:
+    def allocate_batch(self, mus: np.array, covs: np.array) -> np.array:
         """
-        Name of this optimizer. The name will be displayed in the MCOS results DataFrame.
+        Create an optimal portfolio allocation for each of a stack of expected returns vectors and covariance matrices.
+        Optimizers that can solve the whole stack at once should override this, by default allocate is called for
+        every pair.
+        @param mus: Stack of expected return vectors, the first axis indexes the simulation
+        @param covs: Stack of expected covariance matrices with shape (n_sims, n_assets, n_assets)
+        @return Matrix of weights with shape (n_sims, n_assets)
         """
-        pass
+        return np.array([self.allocate(mu, cov) for mu, cov in zip(mus, covs)])
 
 
 class MarkowitzOptimizer(AbstractOptimizer):
     """Optimizer based on the Modern Portfolio Theory pioneered by Harry Markowitz's paper 'Portfolio Selection'"""
 
+    name = 'markowitz'
+
     def allocate(self, mu: np.array, cov: np.array) -> np.array:
         ef = EfficientFrontier(mu, cov)
         ef.max_sharpe()
@@ -48,16 +78,14 @@ class MarkowitzOptimizer(AbstractOptimizer):
 
         return np.array(list(weights.values()))
 
-    @property
-    def name(self) -> str:
-        return 'markowitz'
-
 
 class NCOOptimizer(AbstractOptimizer):
     """
     Nested clustered optimization (NCO) optimizer based on section 4.3 of "A Robust Estimator of the Efficient Frontier
     """
 
+    name = 'NCO'
+
     def __init__(self, max_num_clusters: int = None, num_clustering_trials=10):
         """
         Set optional variables used during calculations
@@ -67,10 +95,6 @@ class NCOOptimizer(AbstractOptimizer):
         self.max_num_clusters = max_num_clusters
         self.num_clustering_trials = num_clustering_trials
 
-    @property
-    def name(self) -> str:
-        return 'NCO'
-
     def allocate(self, mu: np.array, cov: np.array) -> np.array:
         """
         Perform the NCO method described in section 4.3 of "A Robust Estimator of the Efficient Frontier"
@@ -180,17 +204,20 @@ class NCOOptimizer(AbstractOptimizer):
         :param mu: vector of expected returns
         :return: optimal portfolio allocation
         """
-        try:
-            inv = np.linalg.inv(cov)
-        except np.linalg.LinAlgError:  # get the pseudo-inverse if the matrix is singular
-            inv = np.linalg.pinv(cov)
-
-        ones = np.ones(shape=(inv.shape[0], 1))
+        ones = np.ones(shape=(cov.shape[0], 1))
 
         if mu is None:
             mu = ones
 
-        w = np.dot(inv, mu)
+        try:
+            # covariance matrices are symmetric positive definite, so solve with a Cholesky factorization
+            w = cho_solve(cho_factor(cov, lower=True, check_finite=False), mu, check_finite=False)
+        except np.linalg.LinAlgError:
+            try:  # fall back to an LU solve for matrices that are not numerically positive definite
+                w = np.linalg.solve(cov, mu)
+            except np.linalg.LinAlgError:  # use the pseudo-inverse if the matrix is singular
+                w = np.dot(np.linalg.pinv(cov), mu)
+
         w /= np.dot(ones.T, w)
         return w.flatten()
 
@@ -201,6 +228,8 @@ class HRPOptimizer(AbstractOptimizer):
      Outperform Out-of-Sample'
     """
 
+    name = 'HRP'
+
     def allocate(self, mu: np.array, cov: np.array) -> np.array:
         """
        Gets position weights according to the hierarchical risk parity method as outlined in Marcos Lopez de Prado's
@@ -209,89 +238,47 @@ class HRPOptimizer(AbstractOptimizer):
        :param mu: vector of expected returns
        :return: List of position weights.
        """
+        cov = np.asarray(cov, dtype=np.float64)
         corr = cov_to_corr(cov)
 
         dist = self._correlation_distance(corr)
+        dist = self._euclidean_distance(dist)
 
-        link = sch.linkage(dist, 'single')  # this step also calculates the Euclidean distance of 'dist'
+        # the condensed form is handed over directly, skipping the symmetry checks since dist is symmetric by
+        # construction
+        link = sch.linkage(squareform(dist, checks=False), 'single')
 
-        sorted_indices = self._quasi_diagonal_cluster_sequence(link)
-        ret = self._hrp_weights(cov, sorted_indices)
+        sorted_indices = _quasi_diagonal_cluster_sequence(link)
+        ret = _hrp_weights(cov, sorted_indices)
         if ret.sum() > 1.001 or ret.sum() < 0.999:
             raise ValueError("Portfolio allocations don't sum to 1.")
 
         return ret
 
-    @property
-    def name(self) -> str:
-        return 'HRP'
-
-    def _inverse_variance_weights(self, cov: np.ndarray) -> np.ndarray:
-        # Compute the inverse-variance portfolio
-        ivp = 1. / np.diag(cov)
-        ivp /= ivp.sum()
-        return ivp
-
-    def _cluster_sub_sequence(self, clustering_data: pd.DataFrame, combined_node: int) -> List:
-        # recurisvely extracts the list of cluster indices that that belong to the children of combined_node
-        row = clustering_data[clustering_data['combined_node'] == combined_node]
-        if row.empty:
-            return [combined_node]
-
-        return self._cluster_sub_sequence(clustering_data, row.iloc[0]['node1']) + \
-               self._cluster_sub_sequence(clustering_data, row.iloc[0]['node2'])
-
-    def _quasi_diagonal_cluster_sequence(self, link: np.ndarray) -> List:
-        # Sort clustered items by distance
-        num_items = link[-1, 3].astype('int')
-        clustering_data = pd.DataFrame(link[:, 0:2].astype('int'), columns=['node1', 'node2'])
-        clustering_data['combined_node'] = clustering_data.index + num_items
-        return self._cluster_sub_sequence(clustering_data, clustering_data.iloc[-1]['combined_node'])
-
-    def _cluster_var(self, cov: np.ndarray) -> np.ndarray:
-        # calculates the overall variance assuming the inverse variance portfolio weights of the constituents
-        w_ = self._inverse_variance_weights(cov).reshape(-1, 1)
-        return np.dot(np.dot(w_.T, cov), w_)[0, 0]
-
-    def _hrp_weights(self, cov: np.ndarray, sorted_indices: List) -> np.ndarray:
-        """
-        Gets position weights using hierarchical risk parity
-        :param cov: covariance matrix
-        :param sorted_indices: clustering scheme
-        :return: array of position weights
-        """
-        if len(sorted_indices) == 0:
-            raise ValueError('sorted_indices is empty')
-
-        if len(sorted_indices) == 1:
-            return np.array([1.])
-
-        split_indices = np.array_split(np.array(sorted_indices), 2)
-
-        left_var = self._cluster_var(cov[:, split_indices[0]][split_indices[0]])
-        right_var = self._cluster_var(cov[:, split_indices[1]][split_indices[1]])
-
-        alloc_factor = 1. - left_var / (left_var + right_var)
-
-        return np.concatenate([
-            np.multiply(self._hrp_weights(cov, split_indices[0]), alloc_factor),
-            np.multiply(self._hrp_weights(cov, split_indices[1]), 1. - alloc_factor)
-        ])
-
     def _correlation_distance(self, corr: np.ndarray) -> np.ndarray:
         # A distance matrix based on correlation, where 0<=d[i,j]<=1
         # This is a proper distance metric
         dist = np.sqrt((1. - corr) / 2.)
-        for i in range(dist.shape[0]):
-            dist[i, i] = 0.  # diagonals should always be 0, but sometimes it's only close to 0
+        np.fill_diagonal(dist, 0.)  # diagonals should always be 0, but sometimes it's only close to 0
         return dist
 
+    def _euclidean_distance(self, dist: np.ndarray) -> np.ndarray:
+        # The Euclidean distance between the columns of dist, sqrt(sum_k (d[k, i] - d[k, j])^2). Expanding the square
+        # gives ||d_i||^2 + ||d_j||^2 - 2 d_i.d_j, so every pair comes out of a single gram matrix product.
+        gram = dist.T @ dist
+        sq_norms = np.diag(gram)
+        sq_dist = sq_norms[:, np.newaxis] + sq_norms[np.newaxis, :] - 2. * gram
+        np.clip(sq_dist, 0., None, out=sq_dist)  # rounding can leave tiny negative values
+        return np.sqrt(sq_dist)
+
 
 class RiskParityOptimizer(AbstractOptimizer):
     """
      Risk Parity Optimizer
     """
 
+    name = 'Risk Parity'
+
     def __init__(self, target_risk: np.array = None):
         self.target_risk = target_risk
 
@@ -311,34 +298,28 @@ class RiskParityOptimizer(AbstractOptimizer):
         ret = self._rp_weights(cov, target_risk)
         return ret
 
-    @property
-    def name(self) -> str:
-        return 'Risk Parity'
-
     # risk budgeting optimization
-    def _calculate_portfolio_var(self, w: np.array, cov: np.array) -> float:
-        # function that calculates portfolio risk
-        w = np.array(w, ndmin=2)
-        return (w @ cov @ w.T)[0, 0]
-
-    def _calculate_risk_contribution(self, w: np.array, cov: np.array) -> np.ndarray:
-        # function that calculates asset contribution to total risk
-        w = np.array(w, ndmin=2)
-        sigma = np.sqrt(self._calculate_portfolio_var(w, cov))
-        # Marginal Risk Contribution
-        MRC = cov @ w.T
-        # Risk Contribution
-        RC = np.multiply(MRC, w.T) / sigma
-        return RC
-
     def _risk_budget_objective(self, x: np.ndarray, pars: List) -> float:
-        # calculate portfolio risk
-        cov, target_risk = pars # covariance table and risk target in percent of portfolio risk
-        sig_p = np.sqrt(self._calculate_portfolio_var(x, cov))  # portfolio sigma
-        risk_target = np.array(np.multiply(sig_p, target_risk), ndmin=2)
-        asset_RC = self._calculate_risk_contribution(x, cov)
-        J = sum(np.square(asset_RC - risk_target.T))[0]  # sum of squared error
-        return J
+        # sum of squared errors between the asset risk contributions and the risk target in percent of portfolio risk
+        cov, target_risk = pars
+        marginal_risk = cov @ x  # computed once, both the portfolio sigma and the risk contributions derive from it
+        sig_p = np.sqrt(x @ marginal_risk)
+        asset_RC = x * marginal_risk / sig_p
+        return np.sum(np.square(asset_RC - sig_p * np.asarray(target_risk)))
+
+    def _risk_budget_gradient(self, x: np.ndarray, pars: List) -> np.ndarray:
+        # analytic gradient of _risk_budget_objective, saves SLSQP from estimating it with n + 1 objective evaluations
+        cov, target_risk = pars
+        target_risk = np.asarray(target_risk)
+        marginal_risk = cov @ x
+        sig_p = np.sqrt(x @ marginal_risk)
+        error = x * marginal_risk / sig_p - sig_p * target_risk
+        return 2. * (
+            error * marginal_risk / sig_p
+            + cov @ (error * x) / sig_p
+            - (error @ (x * marginal_risk)) * marginal_risk / sig_p ** 3
+            - (error @ target_risk) * marginal_risk / sig_p
+        )
 
     def _total_weight_constraint(self, x):
         return np.sum(x) - 1.0
@@ -353,7 +334,75 @@ class RiskParityOptimizer(AbstractOptimizer):
 
         # changed disp to false to remove excess risk parity logging
         res = minimize(self._risk_budget_objective, w0, args=[cov, target_risk], method='SLSQP', constraints=cons,
-                       options={'disp': False})
+                       jac=self._risk_budget_gradient, options={'disp': False})
         w_rb = np.array(res.x)
 
         return w_rb
+
+
+@_jit
+def _quasi_diagonal_cluster_sequence(link: np.ndarray) -> np.ndarray:
+    """
+    Sorts the clustered items by distance, i.e. lists the leaves of the linkage tree from left to right
+    :param link: linkage matrix as returned by scipy.cluster.hierarchy.linkage
+    :return: array of item indices
+    """
+    num_items = link.shape[0] + 1
+    sorted_indices = np.empty(num_items, dtype=np.int64)
+    n_sorted = 0
+
+    stack = [2 * num_items - 2]  # the root is the last combined node
+    while len(stack) > 0:
+        node = stack.pop()
+        if node < num_items:
+            sorted_indices[n_sorted] = node
+            n_sorted += 1
+        else:
+            # push the right child first so that the left child's sub sequence comes first
+            stack.append(np.int64(link[node - num_items, 1]))
+            stack.append(np.int64(link[node - num_items, 0]))
+
+    return sorted_indices
+
+
+def _numpy_cluster_var(cov: np.ndarray, indices: np.ndarray) -> float:
+    # calculates the overall variance of the cluster assuming the inverse variance portfolio weights of its constituents
+    cluster_cov = cov[indices][:, indices]
+    ivp = 1. / np.diag(cluster_cov)
+    ivp /= ivp.sum()
+    return np.dot(ivp, np.dot(cluster_cov, ivp))
+
+
+# the numba kernels can only call other numba kernels, so the compiled cython kernel is used when numba is missing
+_cluster_var = cluster_var if njit is None and cluster_var is not None else _jit(_numpy_cluster_var)
+
+
+@_jit
+def _hrp_weights(cov: np.ndarray, sorted_indices: np.ndarray) -> np.ndarray:
+    """
+    Gets position weights using hierarchical risk parity by recursively bisecting the sorted items
+    :param cov: covariance matrix
+    :param sorted_indices: clustering scheme
+    :return: array of position weights, in the order of sorted_indices
+    """
+    weights = np.ones(sorted_indices.shape[0])
+
+    # (start, end) ranges of sorted_indices that still have to be bisected
+    stack = [(0, sorted_indices.shape[0])]
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        middle = start + (end - start + 1) // 2
+        left_var = _cluster_var(cov, sorted_indices[start:middle])
+        right_var = _cluster_var(cov, sorted_indices[middle:end])
+
+        alloc_factor = 1. - left_var / (left_var + right_var)
+        weights[start:middle] *= alloc_factor
+        weights[middle:end] *= 1. - alloc_factor
+
+        stack.append((start, middle))
+        stack.append((middle, end))
+
+    return weights
@@ -1,4 +1,11 @@
-from setuptools import setup
+from setuptools import Extension, setup
+
+try:
+    from Cython.Build import cythonize
+except ImportError:  # the compiled HRP kernel is optional, mcos falls back to numba or numpy without it
+    ext_modules = []
+else:
+    ext_modules = cythonize([Extension('mcos._hrp_kernel', ['mcos/_hrp_kernel.pyx'])])
 
 with open('README.md', 'r') as fh:
     long_description = fh.read()
@@ -6,6 +13,7 @@ with open('README.md', 'r') as fh:
 setup(
   name='mcos',
   packages=['mcos'],
+  ext_modules=ext_modules,
   version='0.2.2',
   license='MIT',
   description='Implementation of Monte Carlo Optimization Selection from the paper "A Robust Estimator of the Efficient Frontier"',
@@ -19,9 +27,13 @@ setup(
     'numpy',
     'pandas',
     'PyPortfolioOpt',
+    'scipy>=1.5',
     'matplotlib',
     'scikit-learn'
   ],
+  extras_require={
+    'numba': ['numba']
+  },
   classifiers=[
     'Development Status :: 3 - Alpha',
     'Intended Audience :: Developers',
@@ -1,7 +1,41 @@
+import os
+from importlib.metadata import version
+
+import numpy as np
 import pandas as pd
 import pytest
+from pypfopt.expected_returns import mean_historical_return
+from pypfopt.risk_models import sample_cov
+
+PRICES_PATH = 'tests/stock_prices.csv'
+# mean_historical_return has changed between PyPortfolioOpt releases, so the cache is kept per version
+MU_PATH = 'tests/stock_prices_mu-{}.npy'.format(version('PyPortfolioOpt'))
+COV_PATH = 'tests/stock_prices_cov-{}.npy'.format(version('PyPortfolioOpt'))
 
 
 @pytest.fixture
 def prices_df() -> pd.DataFrame:
-    return pd.read_csv('tests/stock_prices.csv', parse_dates=True, index_col='date')
+    return pd.read_csv(PRICES_PATH, parse_dates=True, index_col='date')
+
+
+@pytest.fixture(scope='session')
+def prices_mu_cov() -> (np.array, np.array):
+    # parsing the csv is slow, so the expected returns and covariance are cached as .npy files next to it and only
+    # recomputed when the prices are newer than the cache
+    if not all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(PRICES_PATH)
+               for path in (MU_PATH, COV_PATH)):
+        prices = pd.read_csv(PRICES_PATH, parse_dates=True, index_col='date')
+        np.save(MU_PATH, mean_historical_return(prices).values)
+        np.save(COV_PATH, sample_cov(prices).values)
+
+    return np.load(MU_PATH, mmap_mode='r'), np.load(COV_PATH, mmap_mode='r')
+
+
+@pytest.fixture(scope='session')
+def mu(prices_mu_cov) -> np.array:
+    return prices_mu_cov[0]
+
+
+@pytest.fixture(scope='session')
+def cov(prices_mu_cov) -> np.array:
+    return prices_mu_cov[1]
@@ -51,6 +51,22 @@ class TestDeNoiserCovarianceTransformer:
         assert results.shape == (20, 20)
         assert_almost_equal(results, de_noised_covariance_matrix_results)
 
+    def test_transform_cache(self, prices_df, de_noised_covariance_matrix_results):
+        covariance_matrix = sample_cov(prices_df).values
+        n_observations = prices_df.size
+        transformer = DeNoiserCovarianceTransformer(cache_size=1)
+
+        results = transformer.transform(covariance_matrix, n_observations)
+        results[0, 0] = 0.  # callers modifying the result must not change the cached matrix
+        results = transformer.transform(covariance_matrix, n_observations)
+
+        assert len(transformer._cache) == 1
+        assert_almost_equal(results, de_noised_covariance_matrix_results)
+
+        transformer.transform(covariance_matrix * 2, n_observations)
+
+        assert len(transformer._cache) == 1
+
 
 def test_cov_to_corr(prices_df):
     covariance_matrix = sample_cov(prices_df).values
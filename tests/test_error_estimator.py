@@ -36,4 +36,20 @@ class TestErrorEstimator:
 
         assert_almost_equal(estimation, expected_value)
 
+    @pytest.mark.parametrize('estimator', [
+        ExpectedOutcomeErrorEstimator(),
+        VarianceErrorEstimator(),
+        SharpeRatioErrorEstimator()
+    ])
+    def test_estimate_batch(self, estimator, mu, cov):
+        rng = np.random.RandomState(0)
+        allocations = rng.dirichlet(np.ones(len(mu)), size=(3, 2))
+        optimal_allocations = rng.dirichlet(np.ones(len(mu)), size=2)
+
+        estimations = estimator.estimate_batch(mu, cov, allocations, optimal_allocations)
+
+        assert estimations.shape == (3, 2)
+        for i, j in np.ndindex(3, 2):
+            assert_almost_equal(estimations[i, j], estimator.estimate(mu, cov, allocations[i, j],
+                                                                      optimal_allocations[j]))
 
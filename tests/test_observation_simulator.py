@@ -0,0 +1,32 @@
+import numpy as np
+from numpy.testing import assert_almost_equal
+from sklearn.covariance import LedoitWolf
+
+from mcos.observation_simulator import MuCovJackknifeObservationSimulator, ledoit_wolf_covariance
+
+
+def test_ledoit_wolf_covariance():
+    x = np.random.RandomState(0).multivariate_normal(np.zeros(4), np.diag([1., 2., 3., 4.]), size=10)
+
+    assert_almost_equal(ledoit_wolf_covariance(x), LedoitWolf().fit(x).covariance_)
+
+
+def test_ledoit_wolf_covariance_batch():
+    x = np.random.RandomState(0).standard_normal((3, 5, 4))
+
+    results = ledoit_wolf_covariance(x)
+
+    assert results.shape == (3, 4, 4)
+    for x_, result in zip(x, results):
+        assert_almost_equal(result, LedoitWolf().fit(x_).covariance_)
+
+
+def test_jackknife_simulate(mu, cov):
+    mu_hat, cov_hat = MuCovJackknifeObservationSimulator(mu, cov, n_observations=5).simulate(np.random.default_rng(0))
+
+    # the same draws, resampled by explicitly leaving each observation out
+    x = np.random.default_rng(0).multivariate_normal(mu, cov, size=5)
+    subsets = [np.delete(x, k, axis=0) for k in range(len(x))]
+
+    assert_almost_equal(mu_hat.flatten(), np.mean([subset.mean(axis=0) for subset in subsets], axis=0))
+    assert_almost_equal(cov_hat, np.mean([np.cov(subset, rowvar=False) for subset in subsets], axis=0))
@@ -1,11 +1,35 @@
 import numpy as np
+import pytest
 from numpy.testing import assert_array_almost_equal
 from pypfopt.expected_returns import mean_historical_return
 from pypfopt.risk_models import sample_cov
-from mcos.optimizer import MarkowitzOptimizer, NCOOptimizer, HRPOptimizer, RiskParityOptimizer
+from mcos.optimizer import AbstractOptimizer, MarkowitzOptimizer, NCOOptimizer, HRPOptimizer, RiskParityOptimizer, \
+    _numpy_cluster_var
 from numpy.testing import assert_almost_equal
 
 
+class TestAbstractOptimizer:
+
+    def test_missing_name(self):
+        class UnnamedOptimizer(AbstractOptimizer):
+            def allocate(self, mu, cov):
+                return mu
+
+        with pytest.raises(TypeError):
+            UnnamedOptimizer()
+
+    def test_name_property(self):
+        class PropertyNameOptimizer(AbstractOptimizer):
+            def allocate(self, mu, cov):
+                return mu
+
+            @property
+            def name(self):
+                return 'property'
+
+        assert PropertyNameOptimizer().name == 'property'
+
+
 class TestMarkowitzOptimizer:
 
     def test_allocate(self, prices_df):
@@ -66,6 +90,12 @@ class TestHRPOptimizer:
     def test_name(self):
         assert HRPOptimizer().name == 'HRP'
 
+    def test_compiled_cluster_var(self, cov):
+        cluster_var = pytest.importorskip('mcos._hrp_kernel').cluster_var
+        indices = np.array([3, 0, 7, 12, 5], dtype=np.intp)
+
+        assert_almost_equal(cluster_var(cov, indices), _numpy_cluster_var(cov, indices))
+
 
 class TestRiskParityOptimizer:
     mu = np.array([0.14, 0.12, 0.15, 0.07])
@@ -88,5 +118,15 @@ class TestRiskParityOptimizer:
         assert_almost_equal(weights, np.array(
             [0.22837243, 0.25116466, 0.08875776, 0.43170515]), decimal=3)
 
+    def test_allocate_batch(self):
+        mus = np.stack([self.mu, self.mu * 2])
+        covs = np.stack([self.cov, self.cov * 0.5])
+
+        weights = RiskParityOptimizer().allocate_batch(mus, covs)
+
+        assert weights.shape == (2, 4)
+        for mu, cov, w in zip(mus, covs, weights):
+            assert_almost_equal(w, RiskParityOptimizer().allocate(mu, cov))
+
     def test_name(self):
         assert RiskParityOptimizer().name == 'Risk Parity'